@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.services.titles import title_untitled_conversations
+
+
+class Command(BaseCommand):
+    help = "Title untitled conversations in batches, one LLM call per batch (run periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument(
+            '--fallback', action='store_true',
+            help="Use the local heuristic title when the LLM call fails, instead of leaving the batch for the next run",
+        )
+
+    def handle(self, *args, **options):
+        titled = title_untitled_conversations(
+            batch_size=options['batch_size'], limit=options['limit'], fallback=options['fallback']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Titled {titled} conversations"))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api.services.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records (run periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None, help="Override IDEMPOTENCY_KEY_TTL_HOURS")
+
+    def handle(self, *args, **options):
+        ttl = timedelta(hours=options['hours']) if options['hours'] is not None else None
+        deleted = purge_expired(ttl)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} idempotency keys"))
@@ -0,0 +1,28 @@
+from argparse import ArgumentTypeError
+
+from django.core.management.base import BaseCommand
+
+from api.services.usage_rollups import compact
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError("must be at least 1")
+    return number
+
+
+class Command(BaseCommand):
+    help = "Fold new messages into the daily and per-user usage rollups (run periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=positive_int, default=50000)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            folded = compact(batch_size=options['batch_size'])
+            if not folded:
+                break
+            total += folded
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {total} messages"))
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class PillMode(models.TextChoices):
     GREEN = 'green', 'Green Pill (Beginner)'
@@ -35,6 +36,28 @@ class Message(models.Model):
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
 
+class IdempotencyKey(models.Model):
+    class Status(models.TextChoices):
+        IN_PROGRESS = 'in_progress', 'In Progress'
+        COMPLETED = 'completed', 'Completed'
+    
+    conversation = models.ForeignKey(Conversation, related_name='idempotency_keys', on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.IN_PROGRESS)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    claimed_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'key'], name='unique_conversation_idempotency_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} ({self.status}) - conversation {self.conversation_id}"
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     preferred_pill_mode = models.CharField(
@@ -45,4 +68,43 @@ class UserProfile(models.Model):
     preferred_language = models.CharField(max_length=50, default='python')
     
     def __str__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+
+class DailyUsage(models.Model):
+    """
+    Messages per day x pill mode x language, maintained by the rollup_usage command
+    """
+    day = models.DateField()
+    pill_mode = models.CharField(max_length=10, choices=PillMode.choices)
+    language = models.CharField(max_length=50)
+    user_messages = models.PositiveIntegerField(default=0)
+    assistant_messages = models.PositiveIntegerField(default=0)
+    estimated_tokens = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'pill_mode', 'language'], name='unique_daily_usage_bucket'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.pill_mode}/{self.language}"
+
+class UserUsage(models.Model):
+    """
+    Lifetime message totals per user, maintained by the rollup_usage command
+    """
+    user = models.OneToOneField(User, related_name='usage', on_delete=models.CASCADE)
+    user_messages = models.PositiveIntegerField(default=0)
+    assistant_messages = models.PositiveIntegerField(default=0)
+    estimated_tokens = models.PositiveBigIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return self.user.username
+
+class UsageRollupCursor(models.Model):
+    """
+    Single row holding the highest Message id already folded into the rollups
+    """
+    last_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
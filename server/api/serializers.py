@@ -1,6 +1,6 @@
 from dj_rest_auth.registration.serializers import RegisterSerializer
 from rest_framework import serializers
-from .models import Conversation, Message, UserProfile
+from .models import Conversation, Message, UserProfile, DailyUsage, UserUsage
 from django.contrib.auth.models import User
 
 class CustomRegisterSerializer(RegisterSerializer):
@@ -55,4 +55,16 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
 class MessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['content']
\ No newline at end of file
+        fields = ['content']
+
+class DailyUsageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyUsage
+        fields = ['day', 'pill_mode', 'language', 'user_messages', 'assistant_messages', 'estimated_tokens']
+
+class UserUsageSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = UserUsage
+        fields = ['user', 'user_messages', 'assistant_messages', 'estimated_tokens', 'last_message_at']
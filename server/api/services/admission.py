@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class Priority:
+    INTERACTIVE = 0  # chat turns a user is actively waiting on
+    BATCH = 1        # code analysis and background jobs
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an LLM call can't get a slot: the wait queue is full or the
+    caller's queue-time deadline passed before a slot freed up.
+    """
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Process-wide limiter in front of the OpenAI calls. At most `max_concurrency`
+    calls run at once; the rest wait in a bounded queue ordered by priority,
+    then arrival. Waiters that outlive their deadline are shed instead of
+    holding a worker until the upstream times out, and a full queue evicts
+    its lowest-priority waiter to admit a higher-priority caller.
+
+    State is per process, so it relies on threaded workers (see
+    gunicorn.conf.py); limits are per worker.
+    """
+
+    def __init__(self, max_concurrency, max_queue, default_timeout):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiters = []  # heap of (priority, seq)
+        self._evicted = set()  # waiters pushed out of a full queue by higher priority
+        self._seq = itertools.count()
+
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_timeout = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self, priority=Priority.INTERACTIVE, timeout=None):
+        """
+        Block until a slot is free. Returns the seconds spent queued.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                self._record_admit(0.0)
+                return 0.0
+
+            if len(self._waiters) >= self.max_queue:
+                # Make room by evicting the lowest-priority, newest waiter,
+                # but only if it ranks below the new caller.
+                victim = max(self._waiters)
+                if victim[0] <= priority:
+                    self._rejected_full += 1
+                    raise AdmissionRejected("queue_full")
+                self._waiters.remove(victim)
+                heapq.heapify(self._waiters)
+                self._evicted.add(victim)
+                self._cond.notify_all()
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    if entry in self._evicted:
+                        self._evicted.discard(entry)
+                        self._rejected_full += 1
+                        raise AdmissionRejected("queue_full")
+                    if self._waiters[0] == entry and self._active < self.max_concurrency:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected_timeout += 1
+                        raise AdmissionRejected("queue_timeout")
+                    self._cond.wait(remaining)
+                heapq.heappop(self._waiters)
+                self._active += 1
+            except AdmissionRejected:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                # The head may have changed, let the next waiter re-check.
+                self._cond.notify_all()
+                raise
+
+            waited = time.monotonic() - start
+            self._record_admit(waited)
+            # Another slot may still be free for the new head of the queue.
+            self._cond.notify_all()
+            return waited
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=Priority.INTERACTIVE, timeout=None):
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """
+        Snapshot of current load and cumulative counters for the metrics endpoint.
+        Covers only this worker process, identified by `pid`.
+        """
+        with self._cond:
+            return {
+                'pid': os.getpid(),
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'queue_depth': len(self._waiters),
+                'queue_depth_by_priority': {
+                    'interactive': sum(1 for p, _ in self._waiters if p == Priority.INTERACTIVE),
+                    'batch': sum(1 for p, _ in self._waiters if p == Priority.BATCH),
+                },
+                'admitted': self._admitted,
+                'rejected_queue_full': self._rejected_full,
+                'rejected_queue_timeout': self._rejected_timeout,
+                'avg_wait_seconds': self._total_wait / self._admitted if self._admitted else 0.0,
+                'max_wait_seconds': self._max_wait,
+            }
+
+    def _record_admit(self, waited):
+        self._admitted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+
+llm_admission = AdmissionController(
+    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 8),
+    max_queue=getattr(settings, 'LLM_MAX_QUEUE', 16),
+    default_timeout=getattr(settings, 'LLM_QUEUE_TIMEOUT', 10.0),
+)
@@ -0,0 +1,128 @@
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from ..models import IdempotencyKey
+
+
+LEASE_MARGIN_SECONDS = 10
+
+
+class IdempotencyKeyMismatch(Exception):
+    """
+    The key was already used on this conversation for a different request body.
+    """
+
+
+class IdempotencyKeyInProgress(Exception):
+    """
+    A request with the same key is still generating after a short wait.
+    """
+
+
+def request_fingerprint(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def lease_duration():
+    """
+    How long a claim is trusted before a duplicate may take it over. Never
+    shorter than the longest a live request can run: its admission queue
+    wait plus the OpenAI request timeout, plus a margin for the DB writes.
+    """
+    longest_request = (
+        getattr(settings, 'LLM_QUEUE_TIMEOUT', 10.0)
+        + getattr(settings, 'LLM_REQUEST_TIMEOUT', 30.0)
+        + LEASE_MARGIN_SECONDS
+    )
+    return timedelta(seconds=max(getattr(settings, 'IDEMPOTENCY_LEASE_SECONDS', 60.0), longest_request))
+
+
+def begin(conversation, key, request_hash, wait_timeout=None, poll_interval=0.25):
+    """
+    Claim `key` for this conversation, or wait briefly for the request already holding it.
+
+    Returns `(record, None)` when the caller owns the key and should do the work,
+    or `(None, record)` with a completed record whose stored response should be
+    replayed. A duplicate that arrives mid-generation polls for a few seconds
+    and then gets IdempotencyKeyInProgress rather than holding a worker. A claim
+    older than the lease belongs to a worker that died, so it is taken over.
+    """
+    if wait_timeout is None:
+        wait_timeout = getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 5)
+    lease = lease_duration()
+    deadline = time.monotonic() + wait_timeout
+
+    while True:
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    conversation=conversation,
+                    key=key,
+                    request_hash=request_hash,
+                )
+            return record, None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(conversation=conversation, key=key).first()
+
+        if existing is None:
+            # The holder failed and released the key between our insert and read
+            continue
+        if existing.request_hash != request_hash:
+            raise IdempotencyKeyMismatch()
+        if existing.status == IdempotencyKey.Status.COMPLETED:
+            return None, existing
+
+        now = timezone.now()
+        if existing.claimed_at < now - lease:
+            # Only one duplicate wins the takeover; the rest see a fresh claim and wait
+            taken = IdempotencyKey.objects.filter(
+                pk=existing.pk,
+                status=IdempotencyKey.Status.IN_PROGRESS,
+                claimed_at=existing.claimed_at,
+            ).update(claimed_at=now)
+            if taken:
+                existing.claimed_at = now
+                return existing, None
+            continue
+
+        if time.monotonic() >= deadline:
+            raise IdempotencyKeyInProgress()
+        time.sleep(poll_interval)
+
+
+def complete(record, response_status, response_body):
+    # Matching on claimed_at keeps a worker whose claim was taken over from
+    # overwriting the new holder's result
+    IdempotencyKey.objects.filter(pk=record.pk, claimed_at=record.claimed_at).update(
+        status=IdempotencyKey.Status.COMPLETED,
+        response_status=response_status,
+        response_body=response_body,
+    )
+
+
+def release(record):
+    """
+    Drop a claim whose request failed so that a retry can run it again.
+    """
+    IdempotencyKey.objects.filter(
+        pk=record.pk,
+        status=IdempotencyKey.Status.IN_PROGRESS,
+        claimed_at=record.claimed_at,
+    ).delete()
+
+
+def purge_expired(ttl=None):
+    """
+    Delete keys older than `ttl` (default IDEMPOTENCY_KEY_TTL_HOURS). Clients
+    only retry within minutes, so old keys are never replayed. Returns the
+    number of rows deleted.
+    """
+    if ttl is None:
+        ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - ttl).delete()
+    return deleted
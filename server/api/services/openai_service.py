@@ -1,10 +1,21 @@
+import json
 import openai
 from django.conf import settings
 from ..models import PillMode
+from .admission import llm_admission, Priority
 
 
 openai.api_key = settings.OPENAI_API_KEY
 
+# openai 0.28 waits up to 600s by default; idempotency leases assume this bound
+REQUEST_TIMEOUT = getattr(settings, 'LLM_REQUEST_TIMEOUT', 30.0)
+
+
+class AIServiceError(Exception):
+    """
+    The upstream call failed, so no reply was generated.
+    """
+
 
 SYSTEM_PROMPTS = {
     PillMode.GREEN: """# SocrAI: Green Pill Mode - Beginner Mentor
@@ -121,19 +132,23 @@ def generate_ai_response(conversation, user_message, pill_mode, language):
 7. Tailor your guidance to the user's skill level based on pill mode"""
     })
     
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.6,  
-            max_tokens=1800,  
-        )
+    # Failures are raised rather than returned as text so the view can answer
+    # 5xx instead of saving an apology as the assistant's reply.
+    with llm_admission.slot(Priority.INTERACTIVE):
+        try:
+            response = openai.ChatCompletion.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.6,  
+                max_tokens=1800,  
+                request_timeout=REQUEST_TIMEOUT,
+            )
+            
+            return response.choices[0].message.content
         
-        return response.choices[0].message.content
-    
-    except Exception as e:
-        print(f"Error generating AI response: {str(e)}")
-        return f"I apologize, but I'm having trouble generating a response right now. Please try again later. Error: {str(e)}"
+        except Exception as e:
+            print(f"Error generating AI response: {str(e)}")
+            raise AIServiceError(str(e)) from e
 
 
 
@@ -156,19 +171,57 @@ You are now analyzing code in {language}. For this code analysis task:
 The code to analyze is provided below.
 """
     
-    try:
+    with llm_admission.slot(Priority.BATCH):
+        try:
+            response = openai.ChatCompletion.create(
+                model="gpt-4o-mini", 
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Please analyze this {language} code:\n\n```{language}\n{code_snippet}\n```"}
+                ],
+                temperature=0.6,
+                max_tokens=1500,
+                request_timeout=REQUEST_TIMEOUT,
+            )
+            
+            return response.choices[0].message.content
+        
+        except Exception as e:
+            print(f"Error analyzing code: {str(e)}")
+            return f"I apologize, but I'm having trouble analyzing this code right now. Please try again later. Error: {str(e)}"
+
+
+
+TITLE_PROMPT = """You write short sidebar titles for coding-mentor conversations.
+
+You will receive a JSON object mapping conversation ids to the opening exchange of each conversation.
+Return a JSON object with a "titles" key mapping every conversation id to a title.
+
+Each title must:
+- be 3-7 words, at most 60 characters
+- name the programming topic or problem, not the user
+- have no quotes and no trailing punctuation"""
+
+
+def generate_titles(openings):
+    """
+    Title many conversations in a single call. `openings` maps conversation id
+    to its first user message (and first reply, if any). Returns {id: title}
+    for the ids the model answered; raises on upstream or parsing errors so
+    the caller can retry or fall back.
+    """
+    with llm_admission.slot(Priority.BATCH):
         response = openai.ChatCompletion.create(
-            model="gpt-4o-mini", 
+            model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Please analyze this {language} code:\n\n```{language}\n{code_snippet}\n```"}
+                {"role": "system", "content": TITLE_PROMPT},
+                {"role": "user", "content": json.dumps({str(k): v for k, v in openings.items()})}
             ],
-            temperature=0.6,
-            max_tokens=1500,
+            response_format={"type": "json_object"},
+            temperature=0.3,
+            max_tokens=40 * len(openings) + 50,
+            request_timeout=REQUEST_TIMEOUT,
         )
-        
-        return response.choices[0].message.content
     
-    except Exception as e:
-        print(f"Error analyzing code: {str(e)}")
-        return f"I apologize, but I'm having trouble analyzing this code right now. Please try again later. Error: {str(e)}"
\ No newline at end of file
+    titles = json.loads(response.choices[0].message.content).get("titles", {})
+    return {int(k): v for k, v in titles.items() if k.isdigit() and isinstance(v, str)}
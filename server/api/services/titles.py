@@ -0,0 +1,105 @@
+import time
+
+from django.db.models import Exists, OuterRef
+
+from ..models import Conversation, Message
+from .openai_service import generate_titles
+
+
+MAX_TITLE_LENGTH = 60
+
+# Enough of the opening exchange to tell what it's about without paying for all of it
+OPENING_CHARS = 500
+
+
+def fallback_title(first_user_message):
+    """
+    Local title from the first line of the user's opening message,
+    cut at a word boundary.
+    """
+    text = ' '.join(first_user_message.strip().splitlines()[0].split()) if first_user_message.strip() else ''
+    if not text:
+        return 'New conversation'
+    if len(text) <= MAX_TITLE_LENGTH:
+        return text
+    cut = text[:MAX_TITLE_LENGTH - 3].rsplit(' ', 1)[0] or text[:MAX_TITLE_LENGTH - 3]
+    return cut + '...'
+
+
+def clean_title(title):
+    title = ' '.join(title.split()).strip('"\'`').rstrip('.!?:;')
+    return title[:MAX_TITLE_LENGTH]
+
+
+def untitled_conversations():
+    """
+    Conversations with no title that have had at least one full exchange.
+    """
+    answered = Message.objects.filter(conversation=OuterRef('pk'), role=Message.Role.ASSISTANT)
+    return Conversation.objects.filter(title='').filter(Exists(answered)).order_by('created_at')
+
+
+def _openings(conversations):
+    openings = {conversation.id: {} for conversation in conversations}
+    messages = (
+        Message.objects
+        .filter(conversation__in=conversations, role__in=[Message.Role.USER, Message.Role.ASSISTANT])
+        .order_by('conversation_id', 'created_at')
+    )
+    for message in messages.iterator():
+        opening = openings[message.conversation_id]
+        if message.role not in opening:
+            opening[message.role] = message.content[:OPENING_CHARS]
+    return openings
+
+
+def _titles_with_retry(openings, attempts, backoff):
+    for attempt in range(attempts):
+        try:
+            return generate_titles(openings)
+        except Exception as e:
+            print(f"Error generating titles (attempt {attempt + 1}/{attempts}): {str(e)}")
+            if attempt + 1 < attempts:
+                time.sleep(backoff * 2 ** attempt)
+    return None
+
+
+def title_batch(conversations, attempts=3, backoff=2.0, fallback=False):
+    """
+    Title one batch with a single LLM call. Conversations the model left out
+    of its answer get a local heuristic title. If every attempt fails the
+    batch stays untitled for the next run, unless `fallback` is set, in which
+    case it all gets heuristic titles. Returns how many were titled.
+    """
+    openings = _openings(conversations)
+    generated = _titles_with_retry(openings, attempts, backoff)
+    if generated is None:
+        if not fallback:
+            return 0
+        generated = {}
+
+    titled = 0
+    for conversation_id, opening in openings.items():
+        title = clean_title(generated.get(conversation_id, ''))
+        if not title:
+            title = fallback_title(opening.get(Message.Role.USER, ''))
+        # update() keeps updated_at (sidebar order) untouched and never
+        # overwrites a title the user set while the job was running
+        titled += Conversation.objects.filter(pk=conversation_id, title='').update(title=title)
+    return titled
+
+
+def title_untitled_conversations(batch_size=20, limit=None, fallback=False):
+    """
+    Title untitled conversations in batches of `batch_size` per LLM call.
+    """
+    queryset = untitled_conversations()
+    if limit is not None:
+        queryset = queryset[:limit]
+    pending = list(queryset.values_list('id', flat=True))
+
+    titled = 0
+    for start in range(0, len(pending), batch_size):
+        batch = list(Conversation.objects.filter(pk__in=pending[start:start + batch_size]))
+        titled += title_batch(batch, fallback=fallback)
+    return titled
@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Length, TruncDate
+from django.utils import timezone
+
+from ..models import DailyUsage, Message, UsageRollupCursor, UserUsage
+
+
+# Rough OpenAI tokenizer ratio for English text and code; we don't store real usage
+CHARS_PER_TOKEN = 4
+
+# Messages younger than this are left for the next run so that rows whose ids
+# were allocated earlier but committed later aren't skipped by the watermark
+SETTLE_DELAY = timedelta(minutes=1)
+
+
+def _message_totals():
+    return {
+        'user_count': Count('id', filter=Q(role=Message.Role.USER)),
+        'assistant_count': Count('id', filter=Q(role=Message.Role.ASSISTANT)),
+        'chars': Sum(Length('content')),
+    }
+
+
+def compact(batch_size=50000):
+    """
+    Fold messages written since the last run into DailyUsage and UserUsage.
+
+    Only messages past the cursor are scanned, so each run costs O(new messages)
+    and dashboard reads never touch Message. Returns the number of messages folded in.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    with transaction.atomic():
+        cursor, _ = UsageRollupCursor.objects.select_for_update().get_or_create(pk=1)
+
+        pending = Message.objects.filter(
+            id__gt=cursor.last_message_id,
+            created_at__lt=timezone.now() - SETTLE_DELAY,
+        ).order_by('id').values_list('id', flat=True)
+        window = list(pending[batch_size - 1:batch_size])
+        upper = window[0] if window else pending.aggregate(top=Max('id'))['top']
+        if upper is None:
+            return 0
+
+        batch = Message.objects.filter(id__gt=cursor.last_message_id, id__lte=upper)
+
+        buckets = batch.values(
+            day=TruncDate('created_at'),
+            pill_mode=F('conversation__pill_mode'),
+            language=F('conversation__language'),
+        ).annotate(**_message_totals())
+        for row in buckets:
+            usage, _ = DailyUsage.objects.get_or_create(
+                day=row['day'], pill_mode=row['pill_mode'], language=row['language']
+            )
+            DailyUsage.objects.filter(pk=usage.pk).update(
+                user_messages=F('user_messages') + row['user_count'],
+                assistant_messages=F('assistant_messages') + row['assistant_count'],
+                estimated_tokens=F('estimated_tokens') + (row['chars'] or 0) // CHARS_PER_TOKEN,
+            )
+
+        per_user = batch.values(user_id=F('conversation__user')).annotate(
+            last_message_at=Max('created_at'), **_message_totals()
+        )
+        for row in per_user:
+            usage, _ = UserUsage.objects.get_or_create(user_id=row['user_id'])
+            usage.user_messages = F('user_messages') + row['user_count']
+            usage.assistant_messages = F('assistant_messages') + row['assistant_count']
+            usage.estimated_tokens = F('estimated_tokens') + (row['chars'] or 0) // CHARS_PER_TOKEN
+            if usage.last_message_at is None or row['last_message_at'] > usage.last_message_at:
+                usage.last_message_at = row['last_message_at']
+            usage.save()
+
+        folded = batch.count()
+        cursor.last_message_id = upper
+        cursor.save()
+        return folded
@@ -1,3 +1,418 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import MagicMock, patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from .models import Conversation, DailyUsage, IdempotencyKey, Message, UsageRollupCursor, UserUsage
+from .services import idempotency, openai_service, usage_rollups
+from .services.admission import AdmissionController, AdmissionRejected, Priority, llm_admission
+
+
+def completion(content):
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=content))]
+    return response
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def setUp(self):
+        self.results = []
+        self.threads = []
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.join(timeout=2)
+
+    def wait_in_thread(self, controller, name, priority, timeout=2):
+        def run():
+            try:
+                controller.acquire(priority, timeout)
+                self.results.append(name)
+            except AdmissionRejected as e:
+                self.results.append((name, e.reason))
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out waiting for the controller")
+            time.sleep(0.01)
+
+    def queue_depth(self, controller, depth):
+        self.wait_until(lambda: controller.stats()['queue_depth'] == depth)
+
+    def test_waiters_are_admitted_by_priority_then_arrival(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=3, default_timeout=2)
+        controller.acquire()
+        for depth, (name, priority) in enumerate(
+            [('batch-1', Priority.BATCH), ('chat', Priority.INTERACTIVE), ('batch-2', Priority.BATCH)], start=1
+        ):
+            self.wait_in_thread(controller, name, priority)
+            self.queue_depth(controller, depth)
+
+        for admitted in range(1, 4):
+            controller.release()
+            self.wait_until(lambda: len(self.results) == admitted)
+
+        self.assertEqual(self.results, ['chat', 'batch-1', 'batch-2'])
+
+    def test_full_queue_rejects_caller_without_higher_priority(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1, default_timeout=2)
+        controller.acquire()
+        self.wait_in_thread(controller, 'chat', Priority.INTERACTIVE)
+        self.queue_depth(controller, 1)
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire(Priority.INTERACTIVE)
+        self.assertEqual(rejected.exception.reason, 'queue_full')
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire(Priority.BATCH)
+        self.assertEqual(controller.stats()['rejected_queue_full'], 2)
+
+        controller.release()
+        self.wait_until(lambda: self.results == ['chat'])
+
+    def test_interactive_caller_evicts_newest_batch_waiter_from_full_queue(self):
+        controller = AdmissionController(max_concurrency=2, max_queue=3, default_timeout=2)
+        controller.acquire()
+        controller.acquire()
+        for depth, name in enumerate(['batch-1', 'batch-2', 'batch-3'], start=1):
+            self.wait_in_thread(controller, name, Priority.BATCH)
+            self.queue_depth(controller, depth)
+
+        self.wait_in_thread(controller, 'chat', Priority.INTERACTIVE)
+        self.wait_until(lambda: ('batch-3', 'queue_full') in self.results)
+
+        controller.release()
+        self.wait_until(lambda: 'chat' in self.results)
+        self.assertNotIn('batch-1', self.results)
+
+        controller.release()
+        controller.release()
+        self.wait_until(lambda: len(self.results) == 4)
+        self.assertEqual(self.results, [('batch-3', 'queue_full'), 'chat', 'batch-1', 'batch-2'])
+
+    def test_waiter_is_shed_after_queue_timeout(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=1, default_timeout=2)
+        controller.acquire()
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire(timeout=0.05)
+
+        self.assertEqual(rejected.exception.reason, 'queue_timeout')
+        stats = controller.stats()
+        self.assertEqual(stats['rejected_queue_timeout'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_next_waiter_takes_over_when_head_times_out(self):
+        controller = AdmissionController(max_concurrency=1, max_queue=2, default_timeout=2)
+        controller.acquire()
+        self.wait_in_thread(controller, 'chat', Priority.INTERACTIVE, timeout=0.05)
+        self.queue_depth(controller, 1)
+        self.wait_in_thread(controller, 'batch', Priority.BATCH)
+        self.queue_depth(controller, 2)
+
+        self.wait_until(lambda: self.results == [('chat', 'queue_timeout')])
+        self.assertEqual(controller.stats()['queue_depth'], 1)
+
+        controller.release()
+        self.wait_until(lambda: 'batch' in self.results)
+
+
+@patch('api.services.openai_service.openai.ChatCompletion.create')
+class SendMessageIdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='learner', password='pass1234')
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('conversation-send-message', args=[self.conversation.pk])
+
+    def send(self, content='How do I reverse a list?', key='key-1'):
+        return self.client.post(self.url, {'content': content}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def claim(self, content='How do I reverse a list?', key='key-1', age=timedelta()):
+        return IdempotencyKey.objects.create(
+            conversation=self.conversation,
+            key=key,
+            request_hash=idempotency.request_fingerprint(content),
+            claimed_at=timezone.now() - age,
+        )
+
+    def test_completed_duplicate_replays_stored_response(self, create):
+        create.return_value = completion('What does slicing give you?')
+
+        first = self.send()
+        second = self.send()
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 2)
+
+    def test_key_reused_with_different_message_is_rejected(self, create):
+        create.return_value = completion('What does slicing give you?')
+
+        self.send()
+        response = self.send(content='Something else entirely')
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(create.call_count, 1)
+
+    def test_blank_or_oversized_key_is_rejected(self, create):
+        for key in ['', '   ', 'k' * 256]:
+            response = self.send(key=key)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        create.assert_not_called()
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_in_progress_duplicate_gets_conflict(self, create):
+        self.claim()
+
+        response = self.send()
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('Retry-After', response)
+        create.assert_not_called()
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+    def test_stale_claim_is_taken_over(self, create):
+        create.return_value = completion('What does slicing give you?')
+        record = self.claim(age=timedelta(minutes=5))
+
+        response = self.send()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(create.call_count, 1)
+        record.refresh_from_db()
+        self.assertEqual(record.status, IdempotencyKey.Status.COMPLETED)
+        self.assertEqual(record.response_body, response.json())
+
+    @override_settings(
+        IDEMPOTENCY_WAIT_TIMEOUT=0, IDEMPOTENCY_LEASE_SECONDS=1,
+        LLM_QUEUE_TIMEOUT=10, LLM_REQUEST_TIMEOUT=30,
+    )
+    def test_claim_within_longest_request_is_not_taken_over(self, create):
+        self.claim(age=timedelta(seconds=45))
+
+        response = self.send()
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        create.assert_not_called()
+
+    def test_openai_calls_are_bounded_by_request_timeout(self, create):
+        create.return_value = completion('What does slicing give you?')
+
+        self.send()
+
+        self.assertEqual(create.call_args.kwargs['request_timeout'], openai_service.REQUEST_TIMEOUT)
+
+    def test_shed_request_releases_key(self, create):
+        create.return_value = completion('What does slicing give you?')
+
+        with patch.object(llm_admission, 'acquire', side_effect=AdmissionRejected('queue_full')):
+            shed = self.send()
+
+        self.assertEqual(shed.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+        retry = self.send()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+
+    def test_upstream_error_releases_key_instead_of_storing_apology(self, create):
+        create.side_effect = [Exception('Request timed out'), completion('What does slicing give you?')]
+
+        failed = self.send()
+
+        self.assertEqual(failed.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+        retry = self.send()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json()['ai_message']['content'], 'What does slicing give you?')
+
+    def test_purge_removes_only_expired_keys(self, create):
+        old = self.claim(key='old')
+        IdempotencyKey.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=2))
+        self.claim(key='recent')
+
+        self.assertEqual(idempotency.purge_expired(timedelta(hours=24)), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['recent'])
+
+
+@patch('api.services.openai_service.openai.ChatCompletion.create')
+class GenerateTitlesCommandTests(TestCase):
+    def setUp(self):
+        sleep = patch('api.services.titles.time.sleep')
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+        self.user = User.objects.create_user(username='learner', password='pass1234')
+        self.goroutines = self.conversation('How do goroutines leak when a channel blocks forever?')
+        self.recursion = self.conversation('Why does my recursive fibonacci take so long?')
+
+    def conversation(self, question):
+        conversation = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=conversation, role=Message.Role.USER, content=question)
+        Message.objects.create(conversation=conversation, role=Message.Role.ASSISTANT, content='What do you think happens?')
+        return conversation
+
+    def titles(self):
+        return {
+            conversation.pk: conversation.title
+            for conversation in Conversation.objects.filter(pk__in=[self.goroutines.pk, self.recursion.pk])
+        }
+
+    def run_command(self, *args):
+        call_command('generate_titles', *args, stdout=StringIO())
+
+    def test_partial_answer_falls_back_only_for_missing_ids(self, create):
+        create.return_value = completion(json.dumps({'titles': {str(self.goroutines.pk): 'Goroutine leaks.'}}))
+
+        self.run_command()
+
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(self.titles(), {
+            self.goroutines.pk: 'Goroutine leaks',
+            self.recursion.pk: 'Why does my recursive fibonacci take so long?',
+        })
+
+    def test_malformed_answer_leaves_batch_for_next_run(self, create):
+        create.return_value = completion('Here are your titles: Goroutine leaks')
+
+        self.run_command()
+
+        self.assertEqual(create.call_count, 3)
+        self.assertEqual(self.titles(), {self.goroutines.pk: '', self.recursion.pk: ''})
+
+    def test_fallback_flag_titles_batch_when_llm_fails(self, create):
+        create.side_effect = Exception('Service unavailable')
+
+        self.run_command('--fallback')
+
+        self.assertEqual(self.titles(), {
+            self.goroutines.pk: 'How do goroutines leak when a channel blocks forever?',
+            self.recursion.pk: 'Why does my recursive fibonacci take so long?',
+        })
+
+    def test_title_set_by_user_meanwhile_is_kept(self, create):
+        def rename_during_call(**kwargs):
+            Conversation.objects.filter(pk=self.goroutines.pk).update(title='My channel bug')
+            return completion(json.dumps({'titles': {
+                str(self.goroutines.pk): 'Goroutine leaks',
+                str(self.recursion.pk): 'Slow recursive fibonacci',
+            }}))
+        create.side_effect = rename_during_call
+
+        self.run_command()
+
+        self.assertEqual(self.titles(), {
+            self.goroutines.pk: 'My channel bug',
+            self.recursion.pk: 'Slow recursive fibonacci',
+        })
+
+
+class UsageDailyViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='ops', is_staff=True))
+        self.url = reverse('usage_daily')
+        self.today = timezone.localdate()
+        for age in (0, 29, 30, 400):
+            DailyUsage.objects.create(
+                day=self.today - timedelta(days=age), pill_mode='green', language='python', user_messages=age
+            )
+
+    def test_defaults_to_last_30_days(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['user_messages'] for row in response.json()['results']], [29, 0])
+
+    def test_explicit_range_within_a_year(self):
+        start = self.today - timedelta(days=365)
+        response = self.client.get(self.url, {'start': start.isoformat(), 'end': self.today.isoformat()})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_rejects_bad_or_oversized_ranges(self):
+        for params in [
+            {'start': (self.today - timedelta(days=366)).isoformat()},
+            {'start': 'yesterday'},
+            {'start': self.today.isoformat(), 'end': (self.today - timedelta(days=1)).isoformat()},
+        ]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UsageRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='learner')
+        self.conversation = Conversation.objects.create(user=self.user, pill_mode='blue', language='go')
+
+    def message(self, role=Message.Role.USER, content='abcd' * 10, age=timedelta(minutes=5)):
+        message = Message.objects.create(conversation=self.conversation, role=role, content=content)
+        Message.objects.filter(pk=message.pk).update(created_at=timezone.now() - age)
+        return message
+
+    def test_watermark_advances_across_batches(self):
+        roles = [Message.Role.USER, Message.Role.ASSISTANT] * 2 + [Message.Role.USER]
+        messages = [self.message(role=role) for role in roles]
+
+        self.assertEqual(usage_rollups.compact(batch_size=2), 2)
+        self.assertEqual(UsageRollupCursor.objects.get().last_message_id, messages[1].pk)
+        self.assertEqual(usage_rollups.compact(batch_size=2), 2)
+        self.assertEqual(usage_rollups.compact(batch_size=2), 1)
+        self.assertEqual(UsageRollupCursor.objects.get().last_message_id, messages[-1].pk)
+
+        daily = DailyUsage.objects.get()
+        self.assertEqual((daily.pill_mode, daily.language), ('blue', 'go'))
+        self.assertEqual((daily.user_messages, daily.assistant_messages, daily.estimated_tokens), (3, 2, 50))
+        usage = UserUsage.objects.get(user=self.user)
+        self.assertEqual((usage.user_messages, usage.assistant_messages, usage.estimated_tokens), (3, 2, 50))
+
+    def test_messages_younger_than_settle_delay_are_skipped(self):
+        settled = self.message()
+        self.message(age=timedelta())
+
+        self.assertEqual(usage_rollups.compact(), 1)
+        self.assertEqual(UsageRollupCursor.objects.get().last_message_id, settled.pk)
+        self.assertEqual(DailyUsage.objects.get().user_messages, 1)
+
+    def test_rerun_adds_nothing(self):
+        self.message()
+        self.message(role=Message.Role.ASSISTANT)
+
+        self.assertEqual(usage_rollups.compact(), 2)
+        self.assertEqual(usage_rollups.compact(), 0)
+        call_command('rollup_usage', stdout=StringIO())
+
+        daily = DailyUsage.objects.get()
+        self.assertEqual((daily.user_messages, daily.assistant_messages), (1, 1))
+        self.assertEqual(UserUsage.objects.get(user=self.user).user_messages, 1)
+
+    def test_batch_size_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            usage_rollups.compact(batch_size=0)
+        for batch_size in ['0', '-5']:
+            with self.assertRaises(CommandError):
+                call_command('rollup_usage', '--batch-size', batch_size, stdout=StringIO())
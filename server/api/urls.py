@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ConversationViewSet, UserProfileViewSet
+from .views import ConversationViewSet, UserProfileViewSet, llm_admission_stats, usage_daily, usage_users
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
@@ -8,4 +8,7 @@ router.register(r'profile', UserProfileViewSet, basename='userprofile')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/llm-admission/', llm_admission_stats, name='llm_admission_stats'),
+    path('metrics/usage/daily/', usage_daily, name='usage_daily'),
+    path('metrics/usage/users/', usage_users, name='usage_users'),
 ]
\ No newline at end of file
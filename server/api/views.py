@@ -1,19 +1,25 @@
 
+from datetime import date, timedelta
+
 from dj_rest_auth.registration.views import RegisterView
 from django.contrib.auth import get_user_model
 from django.http import JsonResponse
 from django.middleware.csrf import get_token
 from django.views.decorators.csrf import ensure_csrf_cookie
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from .models import Conversation, Message, UserProfile, PillMode
+from .models import Conversation, Message, UserProfile, PillMode, DailyUsage, UserUsage, IdempotencyKey
 from .serializers import (
     ConversationSerializer, MessageSerializer, UserProfileSerializer,
-    ConversationCreateSerializer, MessageCreateSerializer, ConversationDetailSerializer
+    ConversationCreateSerializer, MessageCreateSerializer, ConversationDetailSerializer,
+    DailyUsageSerializer, UserUsageSerializer
 )
 from django.shortcuts import get_object_or_404
-from .services.openai_service import generate_ai_response
+from django.utils import timezone
+from .services.openai_service import generate_ai_response, AIServiceError
+from .services.admission import llm_admission, AdmissionRejected
+from .services import idempotency
 
 
 class CustomRegisterView(RegisterView):
@@ -33,6 +39,71 @@ def get_csrf_token(request):
     return JsonResponse({'csrfToken': get_token(request)})
 
 
+def overloaded_response(error):
+    """
+    Fast 503 for requests shed by the LLM admission controller
+    """
+    response = Response(
+        {"error": "The AI mentor is busy right now. Please try again shortly.", "reason": error.reason},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = '5'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def llm_admission_stats(request):
+    """
+    Queue depth, wait time and rejection counters for the LLM limiter
+    of the worker process that serves the request
+    """
+    return Response(llm_admission.stats())
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def usage_daily(request):
+    """
+    Rolled-up message and token counts per day, pill mode and language.
+    Optional filters: start, end (YYYY-MM-DD), pill_mode, language.
+    Defaults to the 30 days ending at `end` (today); ranges over a year are refused
+    """
+    params = request.query_params
+    try:
+        end = date.fromisoformat(params['end']) if params.get('end') else timezone.localdate()
+        start = date.fromisoformat(params['start']) if params.get('start') else end - timedelta(days=29)
+    except ValueError:
+        return Response({"error": "Dates must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end or (end - start).days > 365:
+        return Response(
+            {"error": "start must be on or before end and at most 365 days earlier"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    queryset = DailyUsage.objects.filter(day__range=(start, end)).order_by('day', 'pill_mode', 'language')
+    for field in ('pill_mode', 'language'):
+        if params.get(field):
+            queryset = queryset.filter(**{field: params[field]})
+    return Response({
+        'start': start,
+        'end': end,
+        'results': DailyUsageSerializer(queryset, many=True).data,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def usage_users(request):
+    """
+    Rolled-up lifetime usage per user, heaviest first. Optional: limit (default 100)
+    """
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 100)), 1000))
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    queryset = UserUsage.objects.select_related('user').order_by('-estimated_tokens')[:limit]
+    return Response(UserUsageSerializer(queryset, many=True).data)
 
 
 class ConversationViewSet(viewsets.ModelViewSet):
@@ -63,37 +134,91 @@ class ConversationViewSet(viewsets.ModelViewSet):
         conversation = self.get_object()
         serializer = MessageCreateSerializer(data=request.data)
         
-        if serializer.is_valid():
-            # Save user message
-            user_message = Message.objects.create(
-                conversation=conversation,
-                role=Message.Role.USER,
-                content=serializer.validated_data['content']
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        content = serializer.validated_data['content']
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return self._exchange(conversation, content)
+        
+        if not key.strip() or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(
+                {"error": "Idempotency-Key must be 1-255 characters"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
+        
+        # Retried POSTs replay the first response instead of calling the LLM again
+        try:
+            record, replay = idempotency.begin(conversation, key, idempotency.request_fingerprint(content))
+        except idempotency.IdempotencyKeyMismatch:
+            return Response(
+                {"error": "Idempotency-Key was already used with a different message"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        except idempotency.IdempotencyKeyInProgress:
+            response = Response(
+                {"error": "A request with this Idempotency-Key is still being processed"},
+                status=status.HTTP_409_CONFLICT
+            )
+            response['Retry-After'] = '2'
+            return response
+        
+        if replay is not None:
+            return Response(replay.response_body, status=replay.response_status)
+        
+        try:
+            response = self._exchange(conversation, content)
+        except BaseException:
+            idempotency.release(record)
+            raise
+        
+        if response.status_code == status.HTTP_201_CREATED:
+            idempotency.complete(record, response.status_code, response.data)
+        else:
+            idempotency.release(record)
+        return response
+    
+    def _exchange(self, conversation, content):
+        # Save user message
+        user_message = Message.objects.create(
+            conversation=conversation,
+            role=Message.Role.USER,
+            content=content
+        )
+        
+        try:
             response_content = generate_ai_response(
                 conversation=conversation,
                 user_message=user_message.content,
                 pill_mode=conversation.pill_mode,
                 language=conversation.language
             )
-            
-            ai_message = Message.objects.create(
-                conversation=conversation,
-                role=Message.Role.ASSISTANT,
-                content=response_content
+        except AdmissionRejected as e:
+            # Nothing was generated, so don't leave an unanswered turn behind
+            user_message.delete()
+            return overloaded_response(e)
+        except AIServiceError:
+            user_message.delete()
+            return Response(
+                {"error": "I apologize, but I'm having trouble generating a response right now. Please try again later."},
+                status=status.HTTP_502_BAD_GATEWAY
             )
-            
-            # Update conversation timestamp
-            conversation.save()  # This will update the updated_at field
-            
-            # Return both messages
-            return Response({
-                'user_message': MessageSerializer(user_message).data,
-                'ai_message': MessageSerializer(ai_message).data
-            }, status=status.HTTP_201_CREATED)
-        
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        ai_message = Message.objects.create(
+            conversation=conversation,
+            role=Message.Role.ASSISTANT,
+            content=response_content
+        )
+        
+        # Update conversation timestamp
+        conversation.save()  # This will update the updated_at field
+        
+        # Return both messages
+        return Response({
+            'user_message': MessageSerializer(user_message).data,
+            'ai_message': MessageSerializer(ai_message).data
+        }, status=status.HTTP_201_CREATED)
     
     @action(detail=False, methods=['post'])
     def analyze_code(self, request):
@@ -113,7 +238,10 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         # Call the code analysis service
         from .services.openai_service import analyze_code
-        analysis = analyze_code(code, pill_mode, language)
+        try:
+            analysis = analyze_code(code, pill_mode, language)
+        except AdmissionRejected as e:
+            return overloaded_response(e)
         
         return Response({"analysis": analysis})
 
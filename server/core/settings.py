@@ -2,6 +2,7 @@ from pathlib import Path
 import os
 from environ import Env
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # 1. Setup base directory
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -103,6 +104,7 @@ DATABASES['default'] = dj_database_url.parse(env('DATABASE_URL'))
 
 CORS_ALLOW_ALL_ORIGINS = True #just for developemnt
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 CSRF_COOKIE_SAMESITE = 'Lax'
 CSRF_COOKIE_HTTPONLY = False
 CSRF_USE_SESSIONS = False  
@@ -195,6 +197,30 @@ ACCCOUNT_EMAIL_SUBJECT_PREFIX = ''
 
 OPENAI_API_KEY = env('OPENAI_API_KEY')
 
+# LLM admission control: concurrent upstream calls, waiters allowed to queue,
+# and how long a waiter may queue (seconds) before being shed with a 503.
+# The limiter lives in each process, so these are per gunicorn worker and the
+# global ceiling is workers x LLM_MAX_CONCURRENCY. It needs threaded workers
+# to have anything to queue; gunicorn.conf.py runs gthread workers with
+# enough threads for LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE.
+LLM_MAX_CONCURRENCY = env.int('LLM_MAX_CONCURRENCY', default=8)
+LLM_MAX_QUEUE = env.int('LLM_MAX_QUEUE', default=16)
+LLM_QUEUE_TIMEOUT = env.float('LLM_QUEUE_TIMEOUT', default=10.0)
+# Upper bound (seconds) on a single OpenAI call, passed as request_timeout
+LLM_REQUEST_TIMEOUT = env.float('LLM_REQUEST_TIMEOUT', default=30.0)
+
+# How long (seconds) a duplicate send_message waits on an in-progress
+# request with the same Idempotency-Key before answering 409 + Retry-After.
+# Keep it short: the duplicate holds a worker while it waits.
+IDEMPOTENCY_WAIT_TIMEOUT = env.float('IDEMPOTENCY_WAIT_TIMEOUT', default=5.0)
+# An in-progress claim older than this (seconds) is assumed to belong to a
+# killed worker and can be taken over. A live request can't hold a claim
+# longer than LLM_QUEUE_TIMEOUT + LLM_REQUEST_TIMEOUT, and the lease is never
+# shorter than that plus a margin, whatever this is set to.
+IDEMPOTENCY_LEASE_SECONDS = env.float('IDEMPOTENCY_LEASE_SECONDS', default=60.0)
+# Keys older than this are deleted by the purge_idempotency_keys command
+IDEMPOTENCY_KEY_TTL_HOURS = env.int('IDEMPOTENCY_KEY_TTL_HOURS', default=24)
+
 ACCOUNT_USERNAME_BLACKLIST = ['admin', 'accounts', 'api']
 
 REST_AUTH = {
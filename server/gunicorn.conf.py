@@ -0,0 +1,18 @@
+# Loaded automatically when gunicorn is started from this directory:
+#   gunicorn core.wsgi
+#
+# LLM admission control (api/services/admission.py) is per process, so it only
+# works with threaded workers: each worker runs up to LLM_MAX_CONCURRENCY
+# upstream calls and queues up to LLM_MAX_QUEUE more, and needs enough threads
+# for both plus headroom for non-LLM requests. The global ceiling on upstream
+# calls is workers x LLM_MAX_CONCURRENCY.
+import os
+
+llm_max_concurrency = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+llm_max_queue = int(os.environ.get('LLM_MAX_QUEUE', 16))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', llm_max_concurrency + llm_max_queue + 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))